@@ -4,16 +4,32 @@
 
 # SPDX-FileContributor: David Pape
 
-import json
+import hashlib
 import logging
+import mmap
+import os
+import tempfile
+import time
+import typing as t
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
 from datetime import date, datetime
+from email.utils import formatdate
+from pathlib import Path
 
 import click
+import requests
+from requests.adapters import HTTPAdapter
+
+from hermes import config
 
 from hermes.model.context import CodeMetaContext
 from hermes.model.path import ContextPath
 
 from hermes.commands.deposit.error import DepositionUnauthorizedError
+from hermes.utils import json_dumps, json_loads
+
+
+_ORCID_PREFIX = "https://orcid.org/"
 
 
 # TODO: It turns out that the schema downloaded here can not be used. Figure out what to
@@ -24,19 +40,54 @@ def prepare_deposit(click_ctx: click.Context, ctx: CodeMetaContext):
     In this case, "prepare" means download the record schema that is required
     by Invenio instances. This is the basis that will be used for metadata
     mapping in the next step.
+
+    The schema is cached in the HERMES cache dir. A cached schema is used without
+    contacting the server until it is older than ``deposit.invenio.schema_cache_ttl``
+    seconds (default: 24 hours).
     """
 
+    _log = logging.getLogger("cli.deposit.invenio")
+
     invenio_path = ContextPath.parse("deposit.invenio")
 
     invenio_ctx = ctx[invenio_path]
+    invenio_config = config.get("deposit").get("invenio", {})
     # TODO: Get these values from config with reasonable defaults.
     recordSchemaUrl = f"{invenio_ctx['siteUrl']}/{invenio_ctx['schemaPaths']['record']}"
 
-    # TODO: cache this download in HERMES cache dir
-    # TODO: ensure to use from cache instead of download if not expired (needs config)
-    response = click_ctx.session.get(recordSchemaUrl)
-    response.raise_for_status()
-    recordSchema = response.json()
+    schema_hash = hashlib.sha256(recordSchemaUrl.encode()).hexdigest()[:16]
+    schema_cache = ctx.get_cache("deposit", f"invenio-schema-{schema_hash}", create=True)
+    schema_cache_ttl = invenio_config.get("schema_cache_ttl", 24 * 60 * 60)
+
+    recordSchema = None
+    headers = {}
+    if schema_cache.is_file():
+        schema_mtime = schema_cache.stat().st_mtime
+        if time.time() - schema_mtime < schema_cache_ttl:
+            _log.debug("Using cached record schema from %s", schema_cache)
+            with open(schema_cache, "rb") as schema_file:
+                recordSchema = json_loads(schema_file.read())
+        else:
+            headers["If-Modified-Since"] = formatdate(schema_mtime, usegmt=True)
+
+    if recordSchema is None:
+        response = click_ctx.session.get(recordSchemaUrl, headers=headers)
+        if response.status_code == 304:
+            _log.debug("Cached record schema in %s is still valid", schema_cache)
+            schema_cache.touch()
+            with open(schema_cache, "rb") as schema_file:
+                recordSchema = json_loads(schema_file.read())
+        else:
+            response.raise_for_status()
+            recordSchema = json_loads(response.content)
+
+            # Write to a temporary file first so that a concurrent run never sees a partial file.
+            with tempfile.NamedTemporaryFile(
+                dir=schema_cache.parent, prefix=schema_cache.name, suffix=".tmp", delete=False
+            ) as schema_tmp:
+                schema_tmp.write(response.content)
+            os.replace(schema_tmp.name, schema_cache)
+
     ctx.update(invenio_path["requiredSchema"], recordSchema)
 
 
@@ -66,6 +117,30 @@ def deposit(click_ctx: click.Context, ctx: CodeMetaContext):
 
     invenio_path = ContextPath.parse("deposit.invenio")
     invenio_ctx = ctx[invenio_path]
+    invenio_config = config.get("deposit").get("invenio", {})
+
+    site_url = invenio_ctx["siteUrl"]
+
+    # Uploads to the bucket run in parallel (and large files are split into parts that
+    # are uploaded in parallel, too), so the connection pool needs to be large enough to
+    # keep one connection per stream alive. The adapter is mounted for the site only and
+    # keeps the retry configuration of the session.
+    upload_workers = invenio_config.get("upload_workers", 4)
+    upload_streams = invenio_config.get("upload_streams", 8)
+
+    # The parts of large files are memory-mapped, so they need to start at an offset that
+    # is a multiple of the allocation granularity.
+    multipart_chunk_size = invenio_config.get("multipart_chunk_size", 64 << 20)
+    if multipart_chunk_size <= 0 or multipart_chunk_size % mmap.ALLOCATIONGRANULARITY:
+        raise ValueError(
+            "deposit.invenio.multipart_chunk_size must be a positive multiple of "
+            f"{mmap.ALLOCATIONGRANULARITY}, got {multipart_chunk_size}"
+        )
+    click_ctx.session.mount(site_url, HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=upload_workers * upload_streams,
+        max_retries=click_ctx.session.get_adapter(site_url).max_retries,
+    ))
 
     if not click_ctx.params["auth_token"]:
         raise DepositionUnauthorizedError("No auth token given for deposition platform")
@@ -73,7 +148,7 @@ def deposit(click_ctx: click.Context, ctx: CodeMetaContext):
 
     existing_record_url = None
 
-    deposit_url = f"{invenio_ctx['siteUrl']}/{invenio_ctx['apiPaths']['depositions']}"
+    deposit_url = f"{site_url}/{invenio_ctx['apiPaths']['depositions']}"
     if existing_record_url is not None:
         # TODO: Get by calling new version on existing record
         deposit_url = None
@@ -84,35 +159,82 @@ def deposit(click_ctx: click.Context, ctx: CodeMetaContext):
     deposition_metadata = invenio_ctx["depositionMetadata"]
     response = click_ctx.session.post(
         deposit_url,
-        json={"metadata": deposition_metadata}
+        data=json_dumps({"metadata": deposition_metadata}),
+        headers={"Content-Type": "application/json"}
     )
     response.raise_for_status()
 
-    deposit = response.json()
+    deposit = json_loads(response.content)
     _log.debug("Created deposit: %s", deposit["links"]["html"])
 
     # Upload the files. We'll use the bucket API rather than the files API as it
     # supports file sizes above 100MB.
     bucket_url = deposit["links"]["bucket"]
-    file_name, file_content = _get_file_for_upload(deposition_metadata)
-
-    response = click_ctx.session.put(
-        f"{bucket_url}/{file_name}",
-        data=file_content.encode()
+    files = _get_files_for_upload(ctx, deposition_metadata)
+    _upload_files(
+        click_ctx.session, bucket_url, files, upload_workers,
+        multipart_threshold=invenio_config.get("multipart_threshold", 128 << 20),
+        chunk_size=multipart_chunk_size,
+        streams=upload_streams,
     )
-    response.raise_for_status()
-
-    # This can potentially be used to verify the checksum
-    # file_resource = response.json()
 
     publish_url = deposit["links"]["publish"]
     response = click_ctx.session.post(publish_url)
     response.raise_for_status()
 
-    record = response.json()
+    record = json_loads(response.content)
     _log.info("Published record: %s", record["links"]["record_html"])
 
 
+# The parts of the deposition metadata that do not depend on the harvested metadata. They
+# are computed only once; fields set to `None` are left out.
+# TODO: Use the fields currently set to `None`.
+# Some more fields are available but they most likely don't relate to software
+# publications targeted by hermes.
+_INVENIO_DEPOSITION_DEFAULTS = {k: v for k, v in {
+    # If upload_type is "publication"/"image", a publication_type/image_type must be
+    # specified. Since hermes targets software publications, this can be ignored and
+    # upload_type can be hard-coded to "software".
+    "upload_type": "software",
+    # TODO: Get from config. This needs to be specified; we can not guess this.
+    # TODO: Needs some more logic:
+    # Possible options are: open, embargoed, restricted, closed. open and
+    # restricted should come with a `license`, embargoed with an `embargo_date`,
+    # restricted with `access_conditions`.
+    "access_right": "open",
+    # TODO: Get this from config/codemeta/GitHub API/...
+    "license": "Apache-2.0",
+    "embargo_date": None,
+    "access_conditions": None,
+    # TODO: If a publisher already has assigned a DOI to the files we want to
+    # upload, it should be used here. In this case, Invenio will not give us a new
+    # one. Set "prereserve_doi" accordingly.
+    "doi": None,
+    # This prereserves a DOI that can then be added to the files before publishing
+    # them.
+    # TODO: Use the DOI we get back from this.
+    "prereserve_doi": True,
+    # TODO: A good source for this could be `tool.poetry.keywords` in pyproject.toml.
+    "keywords": None,
+    "notes": None,
+    "related_identifiers": None,
+    # TODO: Use contributors. In the case of the hermes workflow itself, the
+    # contributors are currently all in `creators` already. So for now, we set this
+    # to `None`. Change this when relationship between authors and contributors can
+    # be specified in the processing step. Contributors can be mapped using
+    # `_codemeta_to_invenio_person(contributor, type="ProjectMember")` (the type should
+    # come from config). Filtering out the "GitHub" contributor should be done elsewhere.
+    "contributors": None,
+    "references": None,
+    # TODO: This has to come from config.
+    "communities": None,
+    "grants": None,
+    "subjects": None,
+    # TODO: Get this from config
+    "version": None,
+}.items() if v is not None}
+
+
 def _codemeta_to_invenio_deposition(metadata: dict) -> dict:
     """The mapping logic.
 
@@ -137,53 +259,10 @@ def _codemeta_to_invenio_deposition(metadata: dict) -> dict:
     differences between Invenio-based platforms.
     """
 
-    creators = [
-        # TODO: Distinguish between @type "Person" and others
-        {
-            k: v for k, v in {
-                # TODO: This is ugly
-                "affiliation": author.get("affiliation", {"legalName": None}).get("legalName"),
-                # Invenio wants "family, given". author.get("name") might not have this format.
-                "name": f"{author.get('familyName')}, {author.get('givenName')}"
-                if author.get("familyName") and author.get("givenName")
-                else author.get("name"),
-                # Invenio expects the ORCID without the URL part
-                "orcid": author.get("@id", "").replace("https://orcid.org/", "") or None,
-            }.items() if v is not None
-        }
-        for author in metadata["author"]
-    ]
-
-    # This is not used at the moment. See comment below in `deposition_metadata` dict.
-    contributors = [  # noqa: F841
-        # TODO: Distinguish between @type "Person" and others
-        {
-            k: v for k, v in {
-                # TODO: This is ugly
-                "affiliation": contributor.get("affiliation", {"legalName": None}).get("legalName"),
-                # Invenio wants "family, given". contributor.get("name") might not have this format.
-                "name": f"{contributor.get('familyName')}, {contributor.get('givenName')}"
-                if contributor.get("familyName") and contributor.get("givenName")
-                else contributor.get("name"),
-                # Invenio expects the ORCID without the URL part
-                "orcid": contributor.get("@id", "").replace("https://orcid.org/", "") or None,
-                # TODO: Many possibilities here. Get from config
-                "type": "ProjectMember",
-            }.items() if v is not None
-        }
-        # TODO: Filtering out "GitHub" should be done elsewhere
-        for contributor in metadata["contributor"] if contributor.get("name") != "GitHub"
-    ]
-
-    # TODO: Use the fields currently set to `None`.
-    # Some more fields are available but they most likely don't relate to software
-    # publications targeted by hermes.
-    deposition_metadata = {k: v for k, v in {
-        # If upload_type is "publication"/"image", a publication_type/image_type must be
-        # specified. Since hermes targets software publications, this can be ignored and
-        # upload_type can be hard-coded to "software".
-        # TODO: Make this a constant maybe.
-        "upload_type": "software",
+    # TODO: Distinguish between @type "Person" and others
+    creators = [_codemeta_to_invenio_person(author) for author in metadata["author"]]
+
+    deposition_metadata = _INVENIO_DEPOSITION_DEFAULTS | {k: v for k, v in {
         # IS0 8601-formatted date
         # TODO: Maybe we want a different date? Then make this configurable. If not,
         # this can be removed as it defaults to today.
@@ -194,51 +273,172 @@ def _codemeta_to_invenio_deposition(metadata: dict) -> dict:
         # `tool.poetry.description` from pyproject.toml or `abstract` from
         # CITATION.cff. This should then be stored in codemeta description field.
         "description": metadata["name"],
-        # TODO: Get from config. This needs to be specified; we can not guess this.
-        # TODO: Needs some more logic:
-        # Possible options are: open, embargoed, restricted, closed. open and
-        # restricted should come with a `license`, embargoed with an `embargo_date`,
-        # restricted with `access_conditions`.
-        "access_right": "open",
-        # TODO: Get this from config/codemeta/GitHub API/...
-        "license": "Apache-2.0",
-        "embargo_date": None,
-        "access_conditions": None,
-        # TODO: If a publisher already has assigned a DOI to the files we want to
-        # upload, it should be used here. In this case, Invenio will not give us a new
-        # one. Set "prereserve_doi" accordingly.
-        "doi": None,
-        # This prereserves a DOI that can then be added to the files before publishing
-        # them.
-        # TODO: Use the DOI we get back from this.
-        "prereserve_doi": True,
-        # TODO: A good source for this could be `tool.poetry.keywords` in pyproject.toml.
-        "keywords": None,
-        "notes": None,
-        "related_identifiers": None,
-        # TODO: Use `contributors`. In the case of the hermes workflow itself, the
-        # contributors are currently all in `creators` already. So for now, we set this
-        # to `None`. Change this when relationship between authors and contributors can
-        # be specified in the processing step.
-        "contributors": None,
-        "references": None,
-        # TODO: This has to come from config.
-        "communities": None,
-        "grants": None,
-        "subjects": None,
-        # TODO: Get this from config
-        "version": None,
     }.items() if v is not None}
 
     return deposition_metadata
 
 
-def _get_file_for_upload(deposition_metadata: dict):
-    """Return a file name and some content to test the file upload with."""
+def _upload_files(session: requests.Session, bucket_url: str, files: t.List[Path], max_workers: int,
+                  multipart_threshold: int = 128 << 20, chunk_size: int = 64 << 20, streams: int = 8):
+    """Upload the given files to an Invenio bucket.
+
+    The uploads are independent of each other, so they are run concurrently using up to
+    ``max_workers`` threads. Errors raised by any upload are propagated to the caller.
+
+    Files larger than ``multipart_threshold`` bytes are uploaded in parts of
+    ``chunk_size`` bytes using :func:`_upload_large`.
+    """
+
+    _log = logging.getLogger("cli.deposit.invenio")
+
+    def _upload_one(path: Path):
+        size = os.stat(path).st_size
+        if size > multipart_threshold:
+            _upload_large(path, bucket_url, session, chunk_size=chunk_size, streams=streams)
+            return
+
+        _log.debug("Uploading file: %s", path)
+        # Pass the size explicitly so the body is not sent with chunked transfer-encoding
+        # and use a large read buffer to reduce the number of read calls while streaming.
+        with open(path, "rb", buffering=1 << 20) as file_content:
+            response = session.put(
+                f"{bucket_url}/{path.name}",
+                data=file_content,
+                headers={"Content-Length": str(size), "Content-Type": "application/octet-stream"}
+            )
+        response.raise_for_status()
+
+        # This can potentially be used to verify the checksum
+        # file_resource = response.json()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_upload_one, path) for path in files]
+        _wait_for_uploads(executor, futures)
+
+
+def _wait_for_uploads(executor: ThreadPoolExecutor, futures: t.List[Future]):
+    """Wait until all uploads are finished and re-raise the first error.
+
+    As soon as one upload fails, the uploads that did not start yet are cancelled. This
+    way, we don't keep sending data for a deposition that will not be published.
+    """
+
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in done:
+        error = future.exception()
+        if error is not None:
+            executor.shutdown(cancel_futures=True)
+            raise error
+
+
+def _upload_large(path: Path, bucket_url: str, session: requests.Session,
+                  chunk_size: int = 64 << 20, streams: int = 8):
+    """Upload a large file to an Invenio bucket using a multipart upload.
+
+    The file is split into parts of ``chunk_size`` bytes which are uploaded in parallel
+    using up to ``streams`` connections. Each part is memory-mapped from the file, so it
+    is not copied into the Python heap before it is sent. Hence, ``chunk_size`` must be a
+    multiple of :data:`mmap.ALLOCATIONGRANULARITY`.
+
+    If any part of the upload fails, the multipart upload is aborted so that no
+    incomplete object is left behind in the bucket.
+
+    See the `Invenio-Files-REST documentation
+    <https://invenio-files-rest.readthedocs.io/en/latest/usage.html#multipart-upload>`_
+    for a description of the multipart upload API.
+    """
+
+    _log = logging.getLogger("cli.deposit.invenio")
+
+    size = os.stat(path).st_size
+    part_count = (size + chunk_size - 1) // chunk_size
+    file_url = f"{bucket_url}/{path.name}"
+
+    _log.debug("Uploading file in %d parts: %s", part_count, path)
+
+    response = session.post(f"{file_url}?uploads", params={"size": size, "partSize": chunk_size})
+    response.raise_for_status()
+    upload_id = json_loads(response.content)["id"]
+
+    def _upload_part(fd: int, part_number: int):
+        offset = part_number * chunk_size
+        length = min(chunk_size, size - offset)
+        with mmap.mmap(fd, length, offset=offset, access=mmap.ACCESS_READ) as part_content:
+            response = session.put(
+                file_url,
+                params={"uploadId": upload_id, "partNumber": part_number},
+                data=part_content,
+                headers={"Content-Length": str(length), "Content-Type": "application/octet-stream"}
+            )
+        response.raise_for_status()
+
+    try:
+        with open(path, "rb") as file_content, ThreadPoolExecutor(max_workers=streams) as executor:
+            fd = file_content.fileno()
+            futures = [executor.submit(_upload_part, fd, part_number) for part_number in range(part_count)]
+            _wait_for_uploads(executor, futures)
+
+        response = session.post(file_url, params={"uploadId": upload_id})
+        response.raise_for_status()
+
+    except Exception:
+        _log.debug("Aborting multipart upload of %s", path)
+        try:
+            session.delete(file_url, params={"uploadId": upload_id})
+        except requests.RequestException as e:
+            _log.warning("Could not abort multipart upload of %s: %s", path, e)
+        raise
+
+
+def _codemeta_to_invenio_person(person: dict, **extra) -> dict:
+    """Map a codemeta person onto an Invenio creator or contributor.
+
+    Fields without a value are left out. Additional fields can be passed as keyword
+    arguments.
+    """
+
+    result = {}
+
+    affiliation = (person.get("affiliation") or {}).get("legalName")
+    if affiliation is not None:
+        result["affiliation"] = affiliation
+
+    # Invenio wants "family, given". person.get("name") might not have this format.
+    family_name = person.get("familyName")
+    given_name = person.get("givenName")
+    name = f"{family_name}, {given_name}" if family_name and given_name else person.get("name")
+    if name is not None:
+        result["name"] = name
+
+    # Invenio expects the ORCID without the URL part
+    orcid = person.get("@id") or ""
+    if orcid.startswith(_ORCID_PREFIX):
+        orcid = orcid[len(_ORCID_PREFIX):]
+    if orcid:
+        result["orcid"] = orcid
+
+    result.update(extra)
+    return result
+
+
+def _get_files_for_upload(ctx: CodeMetaContext, deposition_metadata: dict) -> t.List[Path]:
+    """Return a list of files to test the file upload with.
+
+    The files are written to the ``deposit`` directory in the HERMES cache.
+    """
+
+    file_content = _get_file_content_for_upload(deposition_metadata)
+    file_path = ctx.init_cache("deposit") / "README.md"
+    file_path.write_text(file_content)
+
+    return [file_path]
+
+
+def _get_file_content_for_upload(deposition_metadata: dict) -> str:
+    """Return some content to test the file upload with."""
 
     timestamp = datetime.now().isoformat()
-    metadata_json = json.dumps(deposition_metadata, indent=2)
-    file_name = "README.md"
+    metadata_json = json_dumps(deposition_metadata, indent=True).decode()
     file_content = f"""# {deposition_metadata["title"]}
 
 {deposition_metadata["description"]}
@@ -250,4 +450,4 @@ Here's a timestamp so that the file changes and we can create a new version of t
 ```
 """
 
-    return file_name, file_content
+    return file_content
@@ -6,17 +6,39 @@
 # SPDX-FileContributor: Michael Meinel
 # SPDX-FileContributor: David Pape
 
-import json
+import functools
 import logging
+import typing as t
 from importlib import metadata
+from itertools import islice
 
 import click
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from hermes import config
 from hermes.model.context import HermesContext, HermesHarvestContext, CodeMetaContext
 from hermes.model.errors import MergeError
-from hermes.utils import hermes_user_agent
+from hermes.utils import hermes_user_agent, json_dumps, json_loads
+
+
+@functools.lru_cache(maxsize=None)
+def _entry_points(group: str, name: t.Optional[str] = None) -> t.Tuple[metadata.EntryPoint, ...]:
+    """
+    Look up the entry points of a given group (and optionally with a given name).
+
+    Discovering entry points needs to scan the metadata of all installed distributions. As the installed
+    distributions do not change while hermes is running, the results are cached so each group is scanned only once.
+
+    :param group: The entry point group to look up.
+    :param name: If given, only the entry points with this name are returned.
+    :return: The matching entry points.
+    """
+
+    if name is None:
+        return tuple(metadata.entry_points(group=group))
+    return tuple(ep for ep in _entry_points(group=group) if ep.name == name)
 
 
 @click.group(invoke_without_command=True)
@@ -37,10 +59,10 @@ def harvest(click_ctx: click.Context):
 
     # Get all harvesters
     harvest_config = config.get("harvest")
-    harvester_names = harvest_config.get('from', [ep.name for ep in metadata.entry_points(group='hermes.harvest')])
+    harvester_names = harvest_config.get('from', [ep.name for ep in _entry_points(group='hermes.harvest')])
 
     for harvester_name in harvester_names:
-        harvesters = metadata.entry_points(group='hermes.harvest', name=harvester_name)
+        harvesters = _entry_points(group='hermes.harvest', name=harvester_name)
         if not harvesters:
             _log.warning("- Harvester %s selected but not found.", harvester_name)
             continue
@@ -53,9 +75,11 @@ def harvest(click_ctx: click.Context):
 
         with HermesHarvestContext(ctx, harvester, harvest_config.get(harvester.name, {})) as harvest_ctx:
             harvest(click_ctx, harvest_ctx)
-            for _key, ((_value, _tag), *_trace) in harvest_ctx._data.items():
-                if any(v != _value and t == _tag for v, t in _trace):
-                    raise MergeError(_key, None, _value)
+            for _key, _entries in harvest_ctx._data.items():
+                _value, _tag = _entries[0]
+                for _alt_value, _alt_tag in islice(_entries, 1, None):
+                    if _alt_tag == _tag and _alt_value != _value:
+                        raise MergeError(_key, None, _value)
 
         _log.info('')
     audit_log.info('')
@@ -79,10 +103,10 @@ def process():
 
     # Get all harvesters
     harvest_config = config.get("harvest")
-    harvester_names = harvest_config.get('from', [ep.name for ep in metadata.entry_points(group='hermes.harvest')])
+    harvester_names = harvest_config.get('from', [ep.name for ep in _entry_points(group='hermes.harvest')])
 
     for harvester_name in harvester_names:
-        harvesters = metadata.entry_points(group='hermes.harvest', name=harvester_name)
+        harvesters = _entry_points(group='hermes.harvest', name=harvester_name)
         if not harvesters:
             _log.warning("- Harvester %s selected but not found.", harvester_name)
             continue
@@ -90,15 +114,15 @@ def process():
         harvester, *_ = harvesters
         audit_log.info("## Process data from %s", harvester.name)
 
-        harvest_context = HermesHarvestContext(ctx, harvester, {})
-        try:
-            harvest_context.load_cache()
         # when the harvest step ran, but there is no cache file, this is a serious flaw
-        except FileNotFoundError:
+        if not ctx.get_cache('harvest', harvester.name).is_file():
             _log.warning("No output data from harvester %s found, skipping", harvester.name)
             continue
 
-        processors = metadata.entry_points(group='hermes.preprocess', name=harvester.name)
+        harvest_context = HermesHarvestContext(ctx, harvester, {})
+        harvest_context.load_cache()
+
+        processors = _entry_points(group='hermes.preprocess', name=harvester.name)
         for processor in processors:
             _log.debug(". Loading context processor %s", processor.value)
             process = processor.load()
@@ -117,11 +141,11 @@ def process():
             audit_log.info('    - %s: %s', ep.name, error)
 
     tags_path = ctx.get_cache('process', 'tags', create=True)
-    with tags_path.open('w') as tags_file:
-        json.dump(ctx.tags, tags_file, indent='  ')
+    with tags_path.open('wb') as tags_file:
+        tags_file.write(json_dumps(ctx.tags, indent=True))
 
-    with open(ctx.get_cache("process", "codemeta", create=True), 'w') as codemeta_file:
-        json.dump(ctx._data, codemeta_file, indent='  ')
+    with open(ctx.get_cache("process", "codemeta", create=True), 'wb') as codemeta_file:
+        codemeta_file.write(json_dumps(ctx._data, indent=True))
 
     logging.shutdown()
 
@@ -141,7 +165,15 @@ def deposit(click_ctx: click.Context, auth_token):
     click_ctx.session = requests.Session()
     click_ctx.session.headers = {
         "User-Agent": hermes_user_agent,
+        "Connection": "keep-alive",
     }
+    # Keep connections to the deposition platform in a pool so that subsequent requests
+    # can reuse them instead of doing a new TLS handshake each time.
+    click_ctx.session.mount("https://", HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    ))
 
     # local import that can be removed later
     from hermes.model.path import ContextPath
@@ -154,8 +186,8 @@ def deposit(click_ctx: click.Context, auth_token):
         return 1
 
     codemeta_path = ContextPath("codemeta")
-    with open(codemeta_file) as codemeta_fh:
-        ctx.update(codemeta_path, json.load(codemeta_fh))
+    with open(codemeta_file, 'rb') as codemeta_fh:
+        ctx.update(codemeta_path, json_loads(codemeta_fh.read()))
 
     # TODO: Remove this
     deposition_platform_path = ContextPath("depositionPlatform")
@@ -182,7 +214,7 @@ def deposit(click_ctx: click.Context, auth_token):
     deposition_platform = ctx["depositionPlatform"]
 
     # Prepare the deposit
-    deposit_preparator_entrypoints = metadata.entry_points(
+    deposit_preparator_entrypoints = _entry_points(
         group="hermes.prepare_deposit",
         name=deposition_platform
     )
@@ -191,7 +223,7 @@ def deposit(click_ctx: click.Context, auth_token):
         deposit_preparator(click_ctx, ctx)
 
     # Map metadata onto target schema
-    metadata_mapping_entrypoints = metadata.entry_points(
+    metadata_mapping_entrypoints = _entry_points(
         group="hermes.metadata_mapping",
         name=deposition_platform
     )
@@ -202,7 +234,7 @@ def deposit(click_ctx: click.Context, auth_token):
     # Make deposit: Update metadata, upload files, publish
     # TODO: Do publish step manually? This would allow users to check the deposition on
     # the site and decide whether they are happy with it.
-    deposition_entrypoints = metadata.entry_points(
+    deposition_entrypoints = _entry_points(
         group="hermes.deposit",
         name=deposition_platform
     )
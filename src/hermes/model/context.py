@@ -7,7 +7,6 @@
 import datetime
 import pathlib
 import traceback
-import json
 import logging
 import shutil
 import typing as t
@@ -18,6 +17,7 @@ from importlib.metadata import EntryPoint
 from hermes.model import errors
 from hermes.model.path import ContextPath
 from hermes.model.errors import HermesValidationError
+from hermes.utils import json_dumps, json_loads
 
 
 _log = logging.getLogger(__name__)
@@ -190,7 +190,8 @@ class HermesHarvestContext(HermesContext):
         data_file = self._base.get_cache('harvest', self._ep.name)
         if data_file.is_file():
             self._log.debug("Loading cache from %s...", data_file)
-            self._data = json.load(data_file.open('r'))
+            with data_file.open('rb') as cache_file:
+                self._data = json_loads(cache_file.read())
 
     def store_cache(self):
         """
@@ -199,7 +200,8 @@ class HermesHarvestContext(HermesContext):
 
         data_file = self.get_cache('harvest', self._ep.name, create=True)
         self._log.debug("Writing cache to %s...", data_file)
-        json.dump(self._data, data_file.open('w'), indent=2)
+        with data_file.open('wb') as cache_file:
+            cache_file.write(json_dumps(self._data, indent=True))
 
     def __enter__(self):
         self.load_cache()
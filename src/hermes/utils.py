@@ -4,8 +4,15 @@
 
 # SPDX-FileContributor: David Pape
 
+import json
+import typing as t
 from importlib.metadata import metadata
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 hermes_metadata = metadata("hermes")
 
@@ -14,3 +21,34 @@ hermes_version = hermes_metadata["version"]
 hermes_homepage = hermes_metadata["home-page"]
 
 hermes_user_agent = f"{hermes_name}/{hermes_version} ({hermes_homepage})"
+
+
+def json_dumps(obj: t.Any, indent: bool = False) -> bytes:
+    """
+    Serialize *obj* to JSON.
+
+    If `orjson` is installed, it is used for serialization. Otherwise, this falls back to the :mod:`json` module.
+
+    :param obj: The object to serialize.
+    :param indent: Select whether the output should be pretty-printed with an indentation of two spaces.
+    :return: The UTF-8 encoded JSON document.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+
+def json_loads(data: bytes | str) -> t.Any:
+    """
+    Deserialize a JSON document.
+
+    If `orjson` is installed, it is used for parsing. Otherwise, this falls back to the :mod:`json` module.
+
+    :param data: The JSON document.
+    :return: The deserialized object.
+    """
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,3 @@
+# SPDX-FileCopyrightText: 2026 agent <agent@local>
+#
+# SPDX-License-Identifier: Apache-2.0
@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2026 agent <agent@local>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+# SPDX-FileContributor: agent
+
+import json
+import mmap
+import os
+import time
+from email.utils import formatdate
+from unittest import mock
+
+import pytest
+import requests
+
+from hermes import config
+from hermes.commands.deposit import invenio
+from hermes.model.context import CodeMetaContext
+from hermes.model.path import ContextPath
+
+
+@pytest.fixture(autouse=True)
+def isolated_config(monkeypatch):
+    # Reading the (empty) deposit configuration must not affect the configuration of other tests
+    monkeypatch.setattr(config, "_config", dict(config._config))
+
+
+@pytest.fixture
+def session():
+    return mock.Mock(spec=requests.Session)
+
+
+@pytest.fixture
+def make_file(tmp_path):
+    def _make_file(name, size):
+        path = tmp_path / name
+        path.write_bytes(b"x" * size)
+        return path
+    return _make_file
+
+
+def test_upload_files(session, make_file):
+    files = [make_file("README.md", 10), make_file("data.bin", 20)]
+
+    invenio._upload_files(session, "https://bucket", files, 2)
+
+    assert sorted(session.put.call_args_list, key=lambda c: c.args) == [
+        mock.call("https://bucket/README.md", data=mock.ANY,
+                  headers={"Content-Length": "10", "Content-Type": "application/octet-stream"}),
+        mock.call("https://bucket/data.bin", data=mock.ANY,
+                  headers={"Content-Length": "20", "Content-Type": "application/octet-stream"}),
+    ]
+
+
+def test_upload_files_large(session, make_file):
+    small, large = make_file("small.bin", 10), make_file("large.bin", 11)
+
+    with mock.patch.object(invenio, "_upload_large") as upload_large:
+        invenio._upload_files(session, "https://bucket", [small, large], 2,
+                              multipart_threshold=10, chunk_size=4096, streams=3)
+
+    upload_large.assert_called_once_with(large, "https://bucket", session, chunk_size=4096, streams=3)
+    session.put.assert_called_once_with("https://bucket/small.bin", data=mock.ANY, headers=mock.ANY)
+
+
+def test_upload_files_error(session, make_file):
+    files = [make_file(f"file{i}.bin", 10) for i in range(5)]
+
+    def _put(url, **kwargs):
+        if url.endswith("file0.bin"):
+            raise requests.HTTPError("upload failed")
+        time.sleep(0.2)
+        return mock.Mock()
+
+    session.put.side_effect = _put
+
+    with pytest.raises(requests.HTTPError, match="upload failed"):
+        invenio._upload_files(session, "https://bucket", files, 1)
+
+    # The worker may already have picked up the next upload, but the others are cancelled
+    assert session.put.call_count <= 2
+
+
+def _requests(session):
+    return [c for c in session.mock_calls if c[0] in ("post", "put", "delete")]
+
+
+@pytest.fixture
+def large_file(make_file):
+    # Two full parts and a shorter last part
+    return make_file("large.bin", 2 * mmap.ALLOCATIONGRANULARITY + 100)
+
+
+def test_upload_large(session, large_file):
+    chunk_size = mmap.ALLOCATIONGRANULARITY
+    session.post.return_value.content = b'{"id": "upload-1"}'
+
+    invenio._upload_large(large_file, "https://bucket", session, chunk_size=chunk_size, streams=1)
+
+    assert _requests(session) == [
+        mock.call.post("https://bucket/large.bin?uploads",
+                       params={"size": 2 * chunk_size + 100, "partSize": chunk_size}),
+        *(
+            mock.call.put("https://bucket/large.bin",
+                          params={"uploadId": "upload-1", "partNumber": part_number},
+                          data=mock.ANY,
+                          headers={"Content-Length": str(length), "Content-Type": "application/octet-stream"})
+            for part_number, length in enumerate([chunk_size, chunk_size, 100])
+        ),
+        mock.call.post("https://bucket/large.bin", params={"uploadId": "upload-1"}),
+    ]
+
+
+def test_upload_large_part_error(session, large_file):
+    session.post.return_value.content = b'{"id": "upload-1"}'
+    session.put.side_effect = requests.HTTPError("part failed")
+
+    with pytest.raises(requests.HTTPError, match="part failed"):
+        invenio._upload_large(large_file, "https://bucket", session,
+                              chunk_size=mmap.ALLOCATIONGRANULARITY, streams=1)
+
+    # The upload is not completed but aborted
+    assert session.post.call_count == 1
+    assert _requests(session)[-1] == mock.call.delete("https://bucket/large.bin", params={"uploadId": "upload-1"})
+
+
+def test_upload_large_complete_error(session, large_file):
+    completed = mock.Mock(**{"raise_for_status.side_effect": requests.HTTPError("complete failed")})
+    session.post.side_effect = [mock.Mock(content=b'{"id": "upload-1"}'), completed]
+
+    with pytest.raises(requests.HTTPError, match="complete failed"):
+        invenio._upload_large(large_file, "https://bucket", session,
+                              chunk_size=mmap.ALLOCATIONGRANULARITY, streams=2)
+
+    assert session.put.call_count == 3
+    session.delete.assert_called_once_with("https://bucket/large.bin", params={"uploadId": "upload-1"})
+
+
+@pytest.fixture
+def invenio_ctx(tmp_path):
+    ctx = CodeMetaContext(tmp_path)
+    invenio_path = ContextPath.parse("deposit.invenio")
+    ctx.update(invenio_path["siteUrl"], "https://invenio.example.org")
+    ctx.update(invenio_path["schemaPaths"]["record"], "api/schemas/record.json")
+    return ctx
+
+
+@pytest.fixture
+def click_ctx(session):
+    return mock.Mock(session=session)
+
+
+def _schema_response(status_code=200, schema=None):
+    return mock.Mock(status_code=status_code, content=json.dumps(schema).encode())
+
+
+def test_prepare_deposit(click_ctx, invenio_ctx, tmp_path):
+    click_ctx.session.get.return_value = _schema_response(schema={"type": "object"})
+
+    invenio.prepare_deposit(click_ctx, invenio_ctx)
+
+    click_ctx.session.get.assert_called_once_with("https://invenio.example.org/api/schemas/record.json", headers={})
+    assert invenio_ctx["deposit.invenio.requiredSchema"] == {"type": "object"}
+
+    # The schema is cached without leaving temporary files behind
+    cache_files = list((tmp_path / ".hermes" / "deposit").iterdir())
+    assert len(cache_files) == 1
+    assert json.loads(cache_files[0].read_text()) == {"type": "object"}
+
+
+def test_prepare_deposit_cached(click_ctx, invenio_ctx):
+    click_ctx.session.get.return_value = _schema_response(schema={"type": "object"})
+    invenio.prepare_deposit(click_ctx, invenio_ctx)
+    click_ctx.session.get.reset_mock()
+
+    invenio.prepare_deposit(click_ctx, invenio_ctx)
+
+    click_ctx.session.get.assert_not_called()
+    assert invenio_ctx["deposit.invenio.requiredSchema"] == {"type": "object"}
+
+
+def test_prepare_deposit_not_modified(click_ctx, invenio_ctx, tmp_path):
+    click_ctx.session.get.return_value = _schema_response(schema={"type": "object"})
+    invenio.prepare_deposit(click_ctx, invenio_ctx)
+
+    # Let the cached schema expire
+    cache_file, = (tmp_path / ".hermes" / "deposit").iterdir()
+    expired = time.time() - 2 * 24 * 60 * 60
+    os.utime(cache_file, (expired, expired))
+    click_ctx.session.get.return_value = _schema_response(status_code=304)
+
+    invenio.prepare_deposit(click_ctx, invenio_ctx)
+
+    click_ctx.session.get.assert_called_with(
+        "https://invenio.example.org/api/schemas/record.json",
+        headers={"If-Modified-Since": formatdate(expired, usegmt=True)}
+    )
+    assert invenio_ctx["deposit.invenio.requiredSchema"] == {"type": "object"}
+    assert cache_file.stat().st_mtime > expired
+
+
+def test_codemeta_to_invenio_deposition():
+    deposition_metadata = invenio._codemeta_to_invenio_deposition({
+        "name": "hermes",
+        "author": [{"name": "Monty Python"}],
+        "contributor": [],
+    })
+
+    assert deposition_metadata["title"] == deposition_metadata["description"] == "hermes"
+    assert deposition_metadata["creators"] == [{"name": "Monty Python"}]
+    assert deposition_metadata["upload_type"] == "software"
+    assert None not in deposition_metadata.values()
+
+
+def test_codemeta_to_invenio_deposition_no_name():
+    deposition_metadata = invenio._codemeta_to_invenio_deposition({"name": None, "author": [], "contributor": []})
+
+    assert "title" not in deposition_metadata
+    assert "description" not in deposition_metadata
+
+
+@pytest.mark.parametrize("person, expected", [
+    ({"familyName": "Python", "givenName": "Monty", "name": "Monty Python"}, {"name": "Python, Monty"}),
+    ({"familyName": "Python", "name": "Monty Python"}, {"name": "Monty Python"}),
+    ({"name": "Monty Python", "affiliation": {"legalName": "BBC"}}, {"affiliation": "BBC", "name": "Monty Python"}),
+    ({"name": "Monty Python", "affiliation": None}, {"name": "Monty Python"}),
+    ({"name": "Monty Python", "@id": "https://orcid.org/0000-0002-1825-0097"},
+     {"name": "Monty Python", "orcid": "0000-0002-1825-0097"}),
+    ({"name": "Monty Python", "@id": "0000-0002-1825-0097"}, {"name": "Monty Python", "orcid": "0000-0002-1825-0097"}),
+    ({"name": "Monty Python", "@id": ""}, {"name": "Monty Python"}),
+    ({"name": "Monty Python", "@id": None}, {"name": "Monty Python"}),
+])
+def test_codemeta_to_invenio_person(person, expected):
+    assert invenio._codemeta_to_invenio_person(person) == expected
+
+
+def test_codemeta_to_invenio_person_extra():
+    assert invenio._codemeta_to_invenio_person({"name": "Monty Python"}, type="ProjectMember") == {
+        "name": "Monty Python",
+        "type": "ProjectMember",
+    }
@@ -0,0 +1,30 @@
+# SPDX-FileCopyrightText: 2026 agent <agent@local>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+# SPDX-FileContributor: agent
+
+import json
+
+import pytest
+
+from hermes import utils
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(utils, "orjson", None)
+    elif utils.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+def test_json_roundtrip(json_backend):
+    data = {"name": "hermes", "author": [{"name": "Monty Python"}], "version": None}
+    assert utils.json_loads(utils.json_dumps(data)) == data
+
+
+def test_json_dumps_indent(json_backend):
+    data = {"name": "hermes", "keywords": ["publishing", "metadata"]}
+    assert utils.json_dumps(data, indent=True).decode() == json.dumps(data, indent=2)